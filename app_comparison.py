@@ -3,98 +3,23 @@ import os
 import json
 import pandas as pd
 from bid_extractor import extract_all_bids, save_extracted_data
-from bid_comparator import load_extracted_bids
+from bid_comparator import load_extracted_bids, build_comparison_table, calculate_file_scores, format_price, style_comparison_table
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-def build_comparison_table(all_bids, fair_comparison=False):
-    """
-    Build a comparison table: Plan vs Files
-    
-    If fair_comparison=True, only include plans where 2+ files have data
-    """
-    
-    # Collect all unique plans across all files
-    all_plans = set()
-    for file_name, plans in all_bids.items():
-        for plan in plans:
-            plan_num = plan.get("plan_number")
-            if plan_num:
-                all_plans.add(plan_num)
-    
-    all_plans = sorted(all_plans)
-    
-    # Build comparison data
-    comparison_data = []
-    skipped_plans = []
-    
-    for plan_num in all_plans:
-        row = {"Plan": plan_num}
-        prices = {}
-        
-        for file_name, plans in all_bids.items():
-            # Find this plan in this file
-            plan_data = next(
-                (p for p in plans if p.get("plan_number") == plan_num), 
-                None
-            )
-            
-            if plan_data and plan_data.get("total_price"):
-                price = plan_data["total_price"]
-                row[file_name] = price
-                prices[file_name] = price
-            else:
-                row[file_name] = None
-        
-        # Fair comparison: Skip if less than 2 files have data
-        if fair_comparison and len(prices) < 2:
-            skipped_plans.append(plan_num)
-            continue
-        
-        # Determine winner (lowest price)
-        if prices:
-            winner = min(prices, key=prices.get)
-            row["Winner"] = winner
-            row["Best_Price"] = prices[winner]
-        else:
-            row["Winner"] = "N/A"
-            row["Best_Price"] = None
-        
-        comparison_data.append(row)
-    
-    return pd.DataFrame(comparison_data), skipped_plans
+# Cache the shared comparison logic across Streamlit reruns
+build_comparison_table = st.cache_data(show_spinner=False)(build_comparison_table)
+calculate_file_scores = st.cache_data(show_spinner=False)(calculate_file_scores)
 
 
-def calculate_file_scores(comparison_df, all_bids):
+@st.cache_data(show_spinner=False)
+def comparison_to_csv(comparison_df):
     """
-    Calculate which file wins overall
+    Serialize the comparison table for download (cached until data changes)
     """
-    file_names = list(all_bids.keys())
-    
-    scores = {file: {
-        "plans_won": 0,
-        "plans_won_list": [],
-        "total_if_chosen": 0,
-        "plans_available": 0
-    } for file in file_names}
-    
-    for _, row in comparison_df.iterrows():
-        plan = row["Plan"]
-        winner = row["Winner"]
-        
-        if winner != "N/A" and winner in scores:
-            scores[winner]["plans_won"] += 1
-            scores[winner]["plans_won_list"].append(plan)
-        
-        # Calculate totals for each file
-        for file in file_names:
-            if pd.notna(row.get(file)):
-                scores[file]["total_if_chosen"] += row[file]
-                scores[file]["plans_available"] += 1
-    
-    return scores
+    return comparison_df.to_csv(index=False)
 
 st.set_page_config(
     page_title="Bid Comparison Tool",
@@ -153,8 +78,8 @@ if "all_bids" in st.session_state:
     fair_mode = st.session_state.get("fair_comparison", False)
     
     # Build comparison
-    comparison_df, skipped_plans = build_comparison_table(all_bids, fair_comparison=fair_mode)
-    scores = calculate_file_scores(comparison_df, all_bids)
+    comparison_df, skipped_plans, matrix = build_comparison_table(all_bids, fair_comparison=fair_mode)
+    _, sorted_scores = calculate_file_scores(matrix)
     
     # Show mode indicator
     if fair_mode:
@@ -170,8 +95,6 @@ if "all_bids" in st.session_state:
     with tab1:
         st.header("🏆 Overall Winner")
         
-        # Sort by plans won
-        sorted_scores = sorted(scores.items(), key=lambda x: x[1]["plans_won"], reverse=True)
         winner_file = sorted_scores[0][0]
         winner_score = sorted_scores[0][1]
         
@@ -208,42 +131,27 @@ if "all_bids" in st.session_state:
         st.markdown("---")
         st.subheader("💰 Savings vs Other Bids")
         
-        savings_data = []
-        for file_name, score in sorted_scores[1:]:
-            if score['total_if_chosen'] > 0:
-                savings = score['total_if_chosen'] - winner_score['total_if_chosen']
-                savings_data.append({
-                    "Compared To": file_name,
-                    "Their Total": f"${score['total_if_chosen']:,.2f}",
-                    "Winner Total": f"${winner_score['total_if_chosen']:,.2f}",
-                    "You Save": f"${savings:,.2f}"
-                })
+        # Build rows as plain tuples and hand them to one DataFrame call
+        winner_total = winner_score['total_if_chosen']
+        savings_data = [
+            (file_name, format_price(score['total_if_chosen']), format_price(winner_total),
+             format_price(score['total_if_chosen'] - winner_total))
+            for file_name, score in sorted_scores[1:]
+            if score['total_if_chosen'] > 0
+        ]
         
         if savings_data:
-            st.table(pd.DataFrame(savings_data))
+            st.table(pd.DataFrame(savings_data, columns=["Compared To", "Their Total", "Winner Total", "You Save"]))
     
     # TAB 2: Plan Comparison
     with tab2:
         st.header("📊 Plan-by-Plan Comparison")
         
-        # Format the dataframe for display
-        display_df = comparison_df.copy()
-        
-        # Format price columns
-        for col in display_df.columns:
-            if col not in ["Plan", "Winner", "Best_Price"]:
-                display_df[col] = display_df[col].apply(
-                    lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A"
-                )
-        
-        display_df["Best_Price"] = display_df["Best_Price"].apply(
-            lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A"
-        )
-        
-        st.dataframe(display_df, width='stretch', height=500)
+        # Format price columns (including Best_Price) lazily at render time
+        st.dataframe(style_comparison_table(comparison_df), width='stretch', height=500)
         
         # Download button
-        csv = comparison_df.to_csv(index=False)
+        csv = comparison_to_csv(comparison_df)
         st.download_button(
             label="📥 Download Comparison CSV",
             data=csv,
@@ -255,25 +163,27 @@ if "all_bids" in st.session_state:
     with tab3:
         st.header("📈 File Scores Ranking")
         
-        # Create ranking table
-        ranking_data = []
-        for rank, (file_name, score) in enumerate(sorted_scores, 1):
-            ranking_data.append({
-                "Rank": f"#{rank}",
-                "File": file_name,
-                "Plans Won": score['plans_won'],
-                "Total Plans": len(comparison_df),
-                "Win Rate": f"{score['plans_won']/len(comparison_df)*100:.1f}%",
-                "Total Cost": f"${score['total_if_chosen']:,.2f}"
-            })
+        # Create ranking table from whole columns in one constructor call
+        files_sorted = [s[0] for s in sorted_scores]
+        plans_won = pd.Series([s[1]["plans_won"] for s in sorted_scores])
+        totals = pd.Series([s[1]["total_if_chosen"] for s in sorted_scores])
+        
+        ranking_df = pd.DataFrame({
+            "Rank": [f"#{rank}" for rank in range(1, len(files_sorted) + 1)],
+            "File": files_sorted,
+            "Plans Won": plans_won,
+            "Total Plans": len(comparison_df),
+            "Win Rate": (plans_won / len(comparison_df) * 100).map("{:.1f}%".format),
+            "Total Cost": totals.map(format_price)
+        })
         
-        st.table(pd.DataFrame(ranking_data))
+        st.table(ranking_df)
         
         # Bar chart
         st.subheader("Plans Won by File")
         chart_data = pd.DataFrame({
-            "File": [s[0][:20] for s in sorted_scores],
-            "Plans Won": [s[1]["plans_won"] for s in sorted_scores]
+            "File": [f[:20] for f in files_sorted],
+            "Plans Won": plans_won
         })
         st.bar_chart(chart_data.set_index("File"))
     
@@ -281,8 +191,9 @@ if "all_bids" in st.session_state:
     with tab4:
         st.header("📄 Raw Extracted Data")
         
+        # Only build a file's DataFrame once the user asks to see it
         for file_name, plans in all_bids.items():
-            with st.expander(f"📄 {file_name} ({len(plans)} plans)"):
+            if st.checkbox(f"📄 {file_name} ({len(plans)} plans)", key=f"raw_{file_name}"):
                 if plans:
                     st.dataframe(pd.DataFrame(plans), width='stretch')
                 else:
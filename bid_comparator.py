@@ -1,106 +1,164 @@
-import json
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+from dataclasses import dataclass
+from json_utils import load_json
 
 def load_extracted_bids(json_path="./extracted_bids.json"):
     """Load extracted bid data from JSON"""
-    with open(json_path, "r") as f:
-        return json.load(f)
+    return load_json(json_path)
 
 
-def build_comparison_table(all_bids):
+# Pre-bound currency formatter (no per-call lambda or f-string spec parsing)
+format_price = "${:,.2f}".format
+
+# Sentinel for a missing price once prices are quantized to cents
+MISSING_CENTS = np.iinfo(np.int64).max
+
+
+def to_cents(prices):
+    """Quantize a float price array to int64 cents (MISSING_CENTS where NaN)"""
+    missing = np.isnan(prices)
+    cents = np.round(np.where(missing, 0, prices) * 100).astype(np.int64)
+    cents[missing] = MISSING_CENTS
+    return cents
+
+
+@dataclass
+class BidMatrix:
+    """
+    Columnar Plan x File prices: prices[i, j] is the price of plans[i]
+    in files[j] (NaN if missing), cents the same prices quantized to cents
+    (MISSING_CENTS if missing), and winner_idx[i] the column of the lowest
+    price for plans[i] (-1 if no file has a price)
+    """
+    plans: np.ndarray
+    files: np.ndarray
+    prices: np.ndarray
+    cents: np.ndarray
+    winner_idx: np.ndarray
+    
+    def take(self, rows):
+        """Keep only the selected plan rows"""
+        return BidMatrix(self.plans[rows], self.files, self.prices[rows], self.cents[rows], self.winner_idx[rows])
+
+
+def build_price_matrix(all_bids):
+    """Flatten all_bids once into a BidMatrix (plans sorted, files in input order)"""
+    
+    # Parallel (file_id, plan_number, price) arrays, one entry per extracted plan
+    entries = [
+        (file_id, p["plan_number"], p.get("total_price") or np.nan)
+        for file_id, plans in enumerate(all_bids.values())
+        for p in plans
+        if p.get("plan_number")
+    ]
+    file_ids = np.fromiter((e[0] for e in entries), dtype=np.intp, count=len(entries))
+    plan_ids = pd.Categorical([e[1] for e in entries])
+    values = np.fromiter((e[2] for e in entries), dtype=np.float64, count=len(entries))
+    
+    # Scatter into the matrix, keeping the first occurrence of a plan per file
+    n_files = len(all_bids)
+    plan_codes = plan_ids.codes.astype(np.intp)
+    _, first = np.unique(plan_codes * n_files + file_ids, return_index=True)
+    prices = np.full((len(plan_ids.categories), n_files), np.nan)
+    prices[plan_codes[first], file_ids[first]] = values[first]
+    
+    # Determine winner (lowest price): integer min over cents, then break
+    # ties within that cent on the exact float price
+    cents = to_cents(prices)
+    if cents.size:
+        min_cents = cents.min(axis=1, keepdims=True)
+        winner_idx = np.where(cents == min_cents, prices, np.inf).argmin(axis=1)
+        has_price = min_cents[:, 0] != MISSING_CENTS
+    else:
+        winner_idx = np.zeros(len(cents), dtype=np.intp)
+        has_price = np.zeros(len(cents), dtype=bool)
+    winner_idx = np.where(has_price, winner_idx, -1)
+    
+    files = np.array(list(all_bids), dtype=object)
+    return BidMatrix(plan_ids.categories.to_numpy(), files, prices, cents, winner_idx)
+
+
+def build_comparison_table(all_bids, fair_comparison=False):
     """
     Build a comparison table: Plan vs Files
     
-    Returns DataFrame like:
+    Returns (DataFrame, skipped_plans, matrix) where matrix is the BidMatrix
+    behind the table and the DataFrame looks like:
     | Plan  | File1.pdf | File2.xlsx | File3.pdf | Winner |
     |-------|-----------|------------|-----------|--------|
     | 4101  | $9,425    | $8,339     | $8,500    | File2  |
+    
+    If fair_comparison=True, only include plans where 2+ files have data
     """
     
-    # Collect all unique plans across all files
-    all_plans = set()
-    for file_name, plans in all_bids.items():
-        for plan in plans:
-            plan_num = plan.get("plan_number")
-            if plan_num:
-                all_plans.add(plan_num)
+    matrix = build_price_matrix(all_bids)
     
-    all_plans = sorted(all_plans)
+    # Fair comparison: Skip if less than 2 files have data
+    skipped_plans = []
+    if fair_comparison:
+        enough_data = (matrix.cents != MISSING_CENTS).sum(axis=1) >= 2
+        skipped_plans = matrix.plans[~enough_data].tolist()
+        matrix = matrix.take(enough_data)
     
-    # Build comparison data
-    comparison_data = []
+    # Winner is picked on exact cents, but Best_Price is the winning cell itself
+    has_price = matrix.winner_idx >= 0
+    best = matrix.prices[np.arange(len(matrix.prices)), matrix.winner_idx]
     
-    for plan_num in all_plans:
-        row = {"Plan": plan_num}
-        prices = {}
-        
-        for file_name, plans in all_bids.items():
-            # Find this plan in this file
-            plan_data = next(
-                (p for p in plans if p.get("plan_number") == plan_num), 
-                None
-            )
-            
-            if plan_data and plan_data.get("total_price"):
-                price = plan_data["total_price"]
-                row[file_name] = price
-                prices[file_name] = price
-            else:
-                row[file_name] = None
-        
-        # Determine winner (lowest price)
-        if prices:
-            winner = min(prices, key=prices.get)
-            row["Winner"] = winner
-            row["Best_Price"] = prices[winner]
-        else:
-            row["Winner"] = "N/A"
-            row["Best_Price"] = None
-        
-        comparison_data.append(row)
+    # Only now materialize a DataFrame, straight from the arrays
+    comparison_df = pd.DataFrame(matrix.prices, columns=matrix.files.tolist())
+    comparison_df.insert(0, "Plan", matrix.plans)
+    comparison_df["Winner"] = np.where(has_price, matrix.files[matrix.winner_idx], "N/A")
+    comparison_df["Best_Price"] = np.where(has_price, best, np.nan)
     
-    return pd.DataFrame(comparison_data)
+    return comparison_df, skipped_plans, matrix
 
 
-def calculate_file_scores(comparison_df, all_bids):
+def calculate_file_scores(matrix):
     """
     Calculate which file wins overall based on:
     1. Number of plans won
     2. Total savings
+    
+    Returns (scores, sorted_scores) where sorted_scores is the list of
+    (file_name, score) pairs ordered by plans won, best first
     """
     
-    file_names = list(all_bids.keys())
+    file_names = matrix.files.tolist()
+    available = matrix.cents != MISSING_CENTS
+    won = matrix.winner_idx >= 0
+    
+    # Count wins and totals per file straight from the matrix (totals in exact cents)
+    plans_won = np.bincount(matrix.winner_idx[won], minlength=len(file_names)).tolist()
+    plans_available = available.sum(axis=0).tolist()
+    totals = (np.where(available, matrix.cents, 0).sum(axis=0) / 100).tolist()
     
     scores = {file: {
-        "plans_won": 0,
-        "plans_won_list": [],
-        "total_if_chosen": 0,
-        "plans_available": 0
-    } for file in file_names}
-    
-    for _, row in comparison_df.iterrows():
-        plan = row["Plan"]
-        winner = row["Winner"]
-        
-        if winner != "N/A" and winner in scores:
-            scores[winner]["plans_won"] += 1
-            scores[winner]["plans_won_list"].append(plan)
-        
-        # Calculate totals for each file
-        for file in file_names:
-            if pd.notna(row.get(file)):
-                scores[file]["total_if_chosen"] += row[file]
-                scores[file]["plans_available"] += 1
+        "plans_won": plans_won[j],
+        "plans_won_list": matrix.plans[matrix.winner_idx == j].tolist(),
+        "total_if_chosen": totals[j],
+        "plans_available": plans_available[j]
+    } for j, file in enumerate(file_names)}
+    
+    # Sort by plans won (once, so every consumer shares the same order)
+    sorted_scores = sorted(scores.items(), key=lambda x: x[1]["plans_won"], reverse=True)
     
-    return scores
+    return scores, sorted_scores
+
+
+def style_comparison_table(comparison_df):
+    """Display view of a comparison table: prices (incl. Best_Price) as $ strings, N/A where missing"""
+    price_cols = [col for col in comparison_df.columns if col not in ("Plan", "Winner")]
+    return comparison_df.style.format({col: format_price for col in price_cols}, na_rep="N/A")
 
 
 def generate_report(all_bids, output_path="./bid_comparison_report.txt"):
     """Generate comprehensive comparison report"""
-    comparison_df = build_comparison_table(all_bids)
-    scores = calculate_file_scores(comparison_df, all_bids)
+    comparison_df, _, matrix = build_comparison_table(all_bids)
+    scores, sorted_scores = calculate_file_scores(matrix)
     
+    file_names = tuple(all_bids)
     report_lines = []
     
     # Header
@@ -112,8 +170,8 @@ def generate_report(all_bids, output_path="./bid_comparison_report.txt"):
     # Files analyzed
     report_lines.append(" FILES ANALYZED:")
     report_lines.append("-" * 40)
-    for i, file_name in enumerate(all_bids.keys(), 1):
-        plan_count = len(all_bids[file_name])
+    for i, (file_name, plans) in enumerate(all_bids.items(), 1):
+        plan_count = len(plans)
         report_lines.append(f" {i}. {file_name} ({plan_count} plans)")
     report_lines.append("")
     
@@ -122,17 +180,22 @@ def generate_report(all_bids, output_path="./bid_comparison_report.txt"):
     report_lines.append("-" * 40)
     report_lines.append("")
     
-    for _, row in comparison_df.iterrows():
-        plan = row["Plan"]
-        winner = row["Winner"]
+    # Pull plain arrays out once instead of building a Series per row
+    plans = comparison_df["Plan"].to_numpy()
+    winners = comparison_df["Winner"].to_numpy()
+    prices = comparison_df[list(file_names)].to_numpy(dtype=np.float64)
+    
+    # Availability mask computed once for the whole matrix
+    available = ~np.isnan(prices)
+    
+    for plan, winner, row_prices, row_available in zip(plans, winners, prices.tolist(), available.tolist()):
         report_lines.append(f"Plan {plan}:")
         
         # Show price from each file
-        for file_name in all_bids.keys():
-            price = row.get(file_name)
-            if pd.notna(price):
+        for file_name, price, has_price in zip(file_names, row_prices, row_available):
+            if has_price:
                 marker = " ✓ LOWEST" if file_name == winner else ""
-                report_lines.append(f" • {file_name}: ${price:,.2f}{marker}")
+                report_lines.append(f" • {file_name}: {format_price(price)}{marker}")
             else:
                 report_lines.append(f" • {file_name}: N/A")
         report_lines.append("")
@@ -142,11 +205,6 @@ def generate_report(all_bids, output_path="./bid_comparison_report.txt"):
     report_lines.append(" FILE SCORES SUMMARY:")
     report_lines.append("-" * 40)
     
-    # Sort by plans won
-    sorted_scores = sorted(scores.items(), 
-                          key=lambda x: x[1]["plans_won"], 
-                          reverse=True)
-    
     for rank, (file_name, score) in enumerate(sorted_scores, 1):
         report_lines.append(f"\n#{rank} {file_name}")
         report_lines.append(f" Plans Won: {score['plans_won']} out of {len(comparison_df)}")
@@ -182,7 +240,7 @@ def generate_report(all_bids, output_path="./bid_comparison_report.txt"):
     
     # Write report with UTF-8 encoding
     report_text = "\n".join(report_lines)
-    with open(output_path, "w", encoding="utf-8") as f:
+    with open(output_path, "w", encoding="utf-8", buffering=1 << 20) as f:
         f.write(report_text)
     
     print(report_text)
@@ -1,14 +1,22 @@
 import os
+import re
 import json
 import pandas as pd
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from loader import load_document
+from extraction_cache import file_cache_key, load_cached_plans, save_cached_plans
+from json_utils import parse_json, dump_json
 from dotenv import load_dotenv
 
 load_dotenv()
 
-llm = ChatOpenAI(temperature=0, model="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY"))
+MODEL = "gpt-4o-mini"
+
+llm = ChatOpenAI(temperature=0, model=MODEL, api_key=os.getenv("OPENAI_API_KEY"))
+
+# Markdown code fences the LLM sometimes wraps its JSON in
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
 
 # Prompt to extract structured plan data
 extraction_prompt = PromptTemplate(
@@ -43,11 +51,21 @@ JSON Output:
 """
 )
 
+# Cached plans are only valid for the model and prompt that produced them
+CACHE_SALT = "|".join([MODEL, extraction_prompt.template])
+
 
 def extract_plans_from_file(file_path):
     """Extract all plan data from a single file"""
     print(f"📄 Processing: {os.path.basename(file_path)}")
     
+    # Skip the LLM entirely if this exact file was extracted before
+    key = file_cache_key(file_path, CACHE_SALT)
+    cached = load_cached_plans(key)
+    if cached is not None:
+        print(f"  ♻️ Using {len(cached)} cached plans")
+        return cached
+    
     # Load document
     docs = load_document(file_path)
     
@@ -58,16 +76,22 @@ def extract_plans_from_file(file_path):
     max_chars = 50000  # Adjust based on model context window
     
     all_plans = []
+    failed = False
     
     if len(all_content) > max_chars:
         # Process in chunks
         chunks = [all_content[i:i+max_chars] for i in range(0, len(all_content), max_chars)]
-        for i, chunk in enumerate(chunks):
+    else:
+        chunks = [all_content]
+    
+    for i, chunk in enumerate(chunks):
+        if len(chunks) > 1:
             print(f"  Processing chunk {i+1}/{len(chunks)}...")
-            plans = extract_plans_from_content(chunk)
+        plans = extract_plans_from_content(chunk)
+        if plans is None:
+            failed = True
+        else:
             all_plans.extend(plans)
-    else:
-        all_plans = extract_plans_from_content(all_content)
     
     # Remove duplicates based on plan_number
     unique_plans = {}
@@ -76,59 +100,57 @@ def extract_plans_from_file(file_path):
         if plan_num and plan_num not in unique_plans:
             unique_plans[plan_num] = plan
     
+    unique_plans = list(unique_plans.values())
+    
+    # Only cache complete extractions so failed chunks are retried next run
+    if not failed:
+        save_cached_plans(key, unique_plans)
+    
     print(f"  ✅ Extracted {len(unique_plans)} unique plans")
-    return list(unique_plans.values())
+    return unique_plans
 
 
 def extract_plans_from_content(content):
-    """Use LLM to extract plans from content"""
+    """Use LLM to extract plans from content (None if the call or parse failed)"""
     try:
         prompt = extraction_prompt.format(content=content)
         response = llm.invoke(prompt)
         
-        # Parse JSON response
-        json_str = response.content.strip()
-        
-        # Clean up response if needed
-        if json_str.startswith("```json"):
-            json_str = json_str[7:]
-        if json_str.startswith("```"):
-            json_str = json_str[3:]
-        if json_str.endswith("```"):
-            json_str = json_str[:-3]
+        # Parse JSON response (strip ```json fences in one pass)
+        json_str = _FENCE_RE.sub("", response.content.strip())
         
-        plans = json.loads(json_str.strip())
+        plans = parse_json(json_str)
         return plans if isinstance(plans, list) else []
     
     except json.JSONDecodeError as e:
         print(f"  ⚠️ JSON parse error: {e}")
-        return []
+        return None
     except Exception as e:
         print(f"  ⚠️ Extraction error: {e}")
-        return []
+        return None
 
 
 def extract_all_bids(data_folder="./data"):
     """Extract plan data from all bid files"""
     all_bids = {}
     
-    for file in os.listdir(data_folder):
-        file_path = os.path.join(data_folder, file)
-        
-        if os.path.isdir(file_path):
-            continue
-        
-        if file.endswith(('.pdf', '.xlsx', '.xls')):
-            plans = extract_plans_from_file(file_path)
-            all_bids[file] = plans
+    # Single directory scan; DirEntry answers is_file() without an extra stat
+    with os.scandir(data_folder) as entries:
+        bid_files = [
+            entry for entry in entries
+            if entry.is_file() and entry.name.endswith(('.pdf', '.xlsx', '.xls'))
+        ]
+    
+    for entry in bid_files:
+        plans = extract_plans_from_file(entry.path)
+        all_bids[entry.name] = plans
     
     return all_bids
 
 
 def save_extracted_data(all_bids, output_path="./extracted_bids.json"):
     """Save extracted bid data to JSON"""
-    with open(output_path, "w") as f:
-        json.dump(all_bids, f, indent=2)
+    dump_json(all_bids, output_path, indent=2)
     print(f"\n💾 Saved extracted data to {output_path}")
 
 
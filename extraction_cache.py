@@ -0,0 +1,37 @@
+import os
+import hashlib
+from json_utils import load_json, dump_json
+
+
+def file_cache_key(file_path, salt=""):
+    """
+    Hash a file's bytes together with the extraction setup (model, prompt,
+    schema) given as salt, so cached plans invalidate when either changes
+    """
+    digest = hashlib.sha256(salt.encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_cached_plans(key, cache_dir="./cache"):
+    """Return the cached plan list for a cache key, or None on a miss"""
+    cache_path = os.path.join(cache_dir, f"{key}.json")
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        return load_json(cache_path)
+    except (ValueError, OSError):
+        # Damaged entry (e.g. from an older, interrupted write): drop it and re-extract
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+        return None
+
+
+def save_cached_plans(key, plans, cache_dir="./cache"):
+    """Persist a file's extracted plans under its cache key"""
+    os.makedirs(cache_dir, exist_ok=True)
+    dump_json(plans, os.path.join(cache_dir, f"{key}.json"))
@@ -0,0 +1,41 @@
+import os
+import json
+import threading
+
+try:
+    import orjson
+except ImportError:  # Fall back to stdlib json
+    orjson = None
+
+
+def parse_json(text):
+    """Parse a JSON string (raises json.JSONDecodeError on bad input)"""
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def load_json(path):
+    """Read a JSON file"""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def dump_json(obj, path, indent=None):
+    """Write obj to a JSON file (indent: None for compact, 2 for pretty)"""
+    if orjson is not None:
+        data = orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    else:
+        data = json.dumps(obj, indent=indent).encode()
+
+    # Write a temp file next to the target and swap it in, so an interrupted
+    # write never leaves a truncated file at path
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
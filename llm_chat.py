@@ -1,11 +1,13 @@
 import streamlit as st
 import os
+import re
 import json
+import numpy as np
 import pandas as pd
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from bid_extractor import extract_all_bids, save_extracted_data
-from bid_comparator import load_extracted_bids
+from bid_comparator import load_extracted_bids, build_comparison_table, calculate_file_scores, format_price, style_comparison_table
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -37,156 +39,85 @@ ANSWER:
 """
 )
 
+# Cache the shared comparison logic across Streamlit reruns
+build_comparison_table = st.cache_data(show_spinner=False)(build_comparison_table)
+calculate_file_scores = st.cache_data(show_spinner=False)(calculate_file_scores)
 
-def build_comparison_table(all_bids, fair_comparison=False):
+
+@st.cache_data(show_spinner=False)
+def generate_context_for_llm(all_bids, comparison_df, summary):
     """
-    Build a comparison table: Plan vs Files
-    
-    If fair_comparison=True, only include plans where 2+ files have data
+    Generate a comprehensive context string for LLM
     """
+    file_names = tuple(all_bids)
     
-    # Collect all unique plans across all files
-    all_plans = set()
-    for file_name, plans in all_bids.items():
-        for plan in plans:
-            plan_num = plan.get("plan_number")
-            if plan_num:
-                all_plans.add(plan_num)
-    
-    all_plans = sorted(all_plans)
-    
-    # Build comparison data
-    comparison_data = []
-    skipped_plans = []
-    
-    for plan_num in all_plans:
-        row = {"Plan": plan_num}
-        prices = {}
-        
-        for file_name, plans in all_bids.items():
-            # Find this plan in this file
-            plan_data = next(
-                (p for p in plans if p.get("plan_number") == plan_num), 
-                None
-            )
-            
-            if plan_data and plan_data.get("total_price"):
-                price = plan_data["total_price"]
-                row[file_name] = price
-                prices[file_name] = price
-            else:
-                row[file_name] = None
-        
-        # Fair comparison: Skip if less than 2 files have data
-        if fair_comparison and len(prices) < 2:
-            skipped_plans.append(plan_num)
-            continue
-        
-        # Determine winner (lowest price)
-        if prices:
-            winner = min(prices, key=prices.get)
-            row["Winner"] = winner
-            row["Best_Price"] = prices[winner]
-        else:
-            row["Winner"] = "N/A"
-            row["Best_Price"] = None
-        
-        comparison_data.append(row)
-    
-    return pd.DataFrame(comparison_data), skipped_plans
+    # File names
+    files_block = "FILES ANALYZED:\n" + "\n".join(
+        f"  {i}. {file_name}" for i, file_name in enumerate(file_names, 1)
+    )
+    
+    # Build every plan's block column by column (one string op per file)
+    winners = comparison_df["Winner"]
+    plan_blocks = "\nPlan " + comparison_df["Plan"].astype(str) + ":"
+    
+    # Price matrix and its availability mask, computed once for all files
+    price_matrix = comparison_df[list(file_names)].to_numpy(dtype=np.float64)
+    available = ~np.isnan(price_matrix)
+    
+    for j, file_name in enumerate(file_names):
+        prices = pd.Series(np.where(available[:, j], price_matrix[:, j], 0), index=comparison_df.index)
+        marker = np.where(winners == file_name, " ✓ LOWEST", "")
+        lines = f"  - {file_name}: " + prices.map(format_price) + marker
+        plan_blocks += "\n" + lines.where(available[:, j], f"  - {file_name}: N/A (no data)")
+    
+    plan_blocks += np.where(winners != "N/A", "\n  → Winner: " + winners, "")
+    
+    # File scores summary, one block per file
+    scores_block = "\n".join(
+        f"\n#{rank} {file_name}\n"
+        f"  - Plans Won: {score['plans_won']}\n"
+        f"  - Win Rate: {score['plans_won']/summary['n_plans']*100:.1f}%\n"
+        f"  - Total Cost: ${score['total_if_chosen']:,.2f}"
+        + (f"\n  - Won Plans: {', '.join(str(p) for p in score['plans_won_list'])}" if score['plans_won_list'] else "")
+        for rank, (file_name, score) in enumerate(summary["sorted_scores"], 1)
+    )
+    
+    # Stitch the sections together in a single join
+    return "\n".join([
+        files_block,
+        "",
+        "PLAN-BY-PLAN COMPARISON:",
+        "-" * 50,
+        *plan_blocks,
+        "",
+        "FILE SCORES SUMMARY:",
+        "-" * 50,
+        scores_block,
+        "",
+        "OVERALL WINNER:",
+        f"  {summary['winner_file']} with {summary['winner_score']['plans_won']} plans won"
+    ])
 
 
-def calculate_file_scores(comparison_df, all_bids):
-    """
-    Calculate which file wins overall
-    """
-    file_names = list(all_bids.keys())
-    
-    scores = {file: {
-        "plans_won": 0,
-        "plans_won_list": [],
-        "total_if_chosen": 0,
-        "plans_available": 0
-    } for file in file_names}
-    
-    for _, row in comparison_df.iterrows():
-        plan = row["Plan"]
-        winner = row["Winner"]
-        
-        if winner != "N/A" and winner in scores:
-            scores[winner]["plans_won"] += 1
-            scores[winner]["plans_won_list"].append(plan)
-        
-        # Calculate totals for each file
-        for file in file_names:
-            if pd.notna(row.get(file)):
-                scores[file]["total_if_chosen"] += row[file]
-                scores[file]["plans_available"] += 1
-    
-    return scores
+# Questions about the whole bid set need every plan in the context
+FULL_CONTEXT_RE = re.compile(r"overall|summar|all plans|each plan|every plan", re.IGNORECASE)
 
 
-def generate_context_for_llm(all_bids, comparison_df, scores):
-    """
-    Generate a comprehensive context string for LLM
-    """
-    context_parts = []
-    
-    # File names
-    context_parts.append("FILES ANALYZED:")
-    for i, file_name in enumerate(all_bids.keys(), 1):
-        context_parts.append(f"  {i}. {file_name}")
-    context_parts.append("")
-    
-    # Plan-wise comparison
-    context_parts.append("PLAN-BY-PLAN COMPARISON:")
-    context_parts.append("-" * 50)
-    
-    for _, row in comparison_df.iterrows():
-        plan = row["Plan"]
-        winner = row["Winner"]
-        context_parts.append(f"\nPlan {plan}:")
-        
-        for file_name in all_bids.keys():
-            price = row.get(file_name)
-            if pd.notna(price):
-                marker = " ✓ LOWEST" if file_name == winner else ""
-                context_parts.append(f"  - {file_name}: ${price:,.2f}{marker}")
-            else:
-                context_parts.append(f"  - {file_name}: N/A (no data)")
-        
-        if winner != "N/A":
-            context_parts.append(f"  → Winner: {winner}")
-    
-    context_parts.append("")
-    
-    # File scores summary
-    context_parts.append("FILE SCORES SUMMARY:")
-    context_parts.append("-" * 50)
-    
-    sorted_scores = sorted(scores.items(), key=lambda x: x[1]["plans_won"], reverse=True)
-    
-    for rank, (file_name, score) in enumerate(sorted_scores, 1):
-        context_parts.append(f"\n#{rank} {file_name}")
-        context_parts.append(f"  - Plans Won: {score['plans_won']}")
-        context_parts.append(f"  - Win Rate: {score['plans_won']/len(comparison_df)*100:.1f}%")
-        context_parts.append(f"  - Total Cost: ${score['total_if_chosen']:,.2f}")
-        if score['plans_won_list']:
-            context_parts.append(f"  - Won Plans: {', '.join(str(p) for p in score['plans_won_list'])}")
-    
-    # Overall winner
-    context_parts.append("")
-    context_parts.append("OVERALL WINNER:")
-    context_parts.append(f"  {sorted_scores[0][0]} with {sorted_scores[0][1]['plans_won']} plans won")
-    
-    return "\n".join(context_parts)
+def select_plans_for_question(comparison_df, question):
+    """Narrow the comparison to the plans a question mentions (all plans if none match)"""
+    if FULL_CONTEXT_RE.search(question):
+        return comparison_df
+    
+    mentioned = set(re.findall(r"\b\d{3,5}\b", question))
+    relevant = comparison_df["Plan"].astype(str).isin(mentioned)
+    return comparison_df[relevant] if relevant.any() else comparison_df
 
 
-def get_chat_response(context, question):
-    """Get LLM response for chat"""
+def stream_chat_response(context, question):
+    """Stream the LLM response for chat as it is generated"""
     prompt = chat_prompt.format(context=context, question=question)
-    response = llm.invoke(prompt)
-    return response.content
+    for chunk in llm.stream(prompt):
+        yield chunk.content
 
 st.set_page_config(
     page_title="Bid Comparison Tool",
@@ -245,8 +176,18 @@ if "all_bids" in st.session_state:
     fair_mode = st.session_state.get("fair_comparison", False)
     
     # Build comparison
-    comparison_df, skipped_plans = build_comparison_table(all_bids, fair_comparison=fair_mode)
-    scores = calculate_file_scores(comparison_df, all_bids)
+    comparison_df, skipped_plans, matrix = build_comparison_table(all_bids, fair_comparison=fair_mode)
+    _, sorted_scores = calculate_file_scores(matrix)
+    
+    # Winner-derived numbers, computed once and shared by every tab and the LLM context
+    winner_file, winner_score = sorted_scores[0]
+    summary = {
+        "sorted_scores": sorted_scores,
+        "winner_file": winner_file,
+        "winner_score": winner_score,
+        "n_plans": len(comparison_df),
+        "win_rate": winner_score["plans_won"] / len(comparison_df) * 100
+    }
     
     # Show mode indicator
     if fair_mode:
@@ -262,11 +203,6 @@ if "all_bids" in st.session_state:
     with tab1:
         st.header("🏆 Overall Winner")
         
-        # Sort by plans won
-        sorted_scores = sorted(scores.items(), key=lambda x: x[1]["plans_won"], reverse=True)
-        winner_file = sorted_scores[0][0]
-        winner_score = sorted_scores[0][1]
-        
         col1, col2, col3 = st.columns(3)
         
         with col1:
@@ -278,14 +214,13 @@ if "all_bids" in st.session_state:
         with col2:
             st.metric(
                 label="Plans Won",
-                value=f"{winner_score['plans_won']} / {len(comparison_df)}"
+                value=f"{winner_score['plans_won']} / {summary['n_plans']}"
             )
         
         with col3:
-            win_rate = winner_score['plans_won'] / len(comparison_df) * 100
             st.metric(
                 label="Win Rate",
-                value=f"{win_rate:.1f}%"
+                value=f"{summary['win_rate']:.1f}%"
             )
         
         st.markdown("---")
@@ -300,39 +235,24 @@ if "all_bids" in st.session_state:
         st.markdown("---")
         st.subheader("💰 Savings vs Other Bids")
         
-        savings_data = []
-        for file_name, score in sorted_scores[1:]:
-            if score['total_if_chosen'] > 0:
-                savings = score['total_if_chosen'] - winner_score['total_if_chosen']
-                savings_data.append({
-                    "Compared To": file_name,
-                    "Their Total": f"${score['total_if_chosen']:,.2f}",
-                    "Winner Total": f"${winner_score['total_if_chosen']:,.2f}",
-                    "You Save": f"${savings:,.2f}"
-                })
+        # Build rows as plain tuples and hand them to one DataFrame call
+        winner_total = winner_score['total_if_chosen']
+        savings_data = [
+            (file_name, format_price(score['total_if_chosen']), format_price(winner_total),
+             format_price(score['total_if_chosen'] - winner_total))
+            for file_name, score in sorted_scores[1:]
+            if score['total_if_chosen'] > 0
+        ]
         
         if savings_data:
-            st.table(pd.DataFrame(savings_data))
+            st.table(pd.DataFrame(savings_data, columns=["Compared To", "Their Total", "Winner Total", "You Save"]))
     
     # TAB 2: Plan Comparison
     with tab2:
         st.header("📊 Plan-by-Plan Comparison")
         
-        # Format the dataframe for display
-        display_df = comparison_df.copy()
-        
-        # Format price columns
-        for col in display_df.columns:
-            if col not in ["Plan", "Winner", "Best_Price"]:
-                display_df[col] = display_df[col].apply(
-                    lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A"
-                )
-        
-        display_df["Best_Price"] = display_df["Best_Price"].apply(
-            lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A"
-        )
-        
-        st.dataframe(display_df, width='stretch', height=500)
+        # Format price columns (including Best_Price) lazily at render time
+        st.dataframe(style_comparison_table(comparison_df), width='stretch', height=500)
         
         # Download button
         csv = comparison_df.to_csv(index=False)
@@ -347,19 +267,18 @@ if "all_bids" in st.session_state:
     with tab3:
         st.header("📈 File Scores Ranking")
         
-        # Create ranking table
-        ranking_data = []
-        for rank, (file_name, score) in enumerate(sorted_scores, 1):
-            ranking_data.append({
-                "Rank": f"#{rank}",
-                "File": file_name,
-                "Plans Won": score['plans_won'],
-                "Total Plans": len(comparison_df),
-                "Win Rate": f"{score['plans_won']/len(comparison_df)*100:.1f}%",
-                "Total Cost": f"${score['total_if_chosen']:,.2f}"
-            })
+        # Create ranking table from a list of tuples in one constructor call
+        n_plans = summary["n_plans"]
+        ranking_data = [
+            (f"#{rank}", file_name, score['plans_won'], n_plans,
+             f"{score['plans_won']/n_plans*100:.1f}%", format_price(score['total_if_chosen']))
+            for rank, (file_name, score) in enumerate(sorted_scores, 1)
+        ]
         
-        st.table(pd.DataFrame(ranking_data))
+        st.table(pd.DataFrame(
+            ranking_data,
+            columns=["Rank", "File", "Plans Won", "Total Plans", "Win Rate", "Total Cost"]
+        ))
         
         # Bar chart
         st.subheader("Plans Won by File")
@@ -402,55 +321,62 @@ if "all_bids" in st.session_state:
         if "chat_history" not in st.session_state:
             st.session_state["chat_history"] = []
         
-        # Generate context for LLM
-        context = generate_context_for_llm(all_bids, comparison_df, scores)
-        
-        # Chat input
-        user_question = st.text_input(
-            "Ask your question:",
-            placeholder="e.g., Plan 4104 kis bid ka best hai aur kyun?",
-            key="chat_input"
-        )
+        # Answers already streamed, keyed by (context, question)
+        if "chat_answers" not in st.session_state:
+            st.session_state["chat_answers"] = {}
         
-        col1, col2 = st.columns([1, 4])
-        with col1:
-            ask_btn = st.button("🔍 Ask", type="primary")
-        with col2:
-            clear_btn = st.button("🗑️ Clear Chat")
+        # Generate context for LLM
+        context = generate_context_for_llm(all_bids, comparison_df, summary)
         
-        if clear_btn:
+        if st.button("🗑️ Clear Chat"):
             st.session_state["chat_history"] = []
             st.rerun()
         
-        if ask_btn and user_question:
-            with st.spinner("🤖 Thinking..."):
-                response = get_chat_response(context, user_question)
+        # Display chat history
+        for chat in st.session_state["chat_history"]:
+            with st.chat_message("user"):
+                st.markdown(chat["question"])
+            with st.chat_message("assistant"):
+                st.markdown(chat["answer"])
+        
+        # Chat input
+        user_question = st.chat_input("e.g., Plan 4104 kis bid ka best hai aur kyun?")
+        
+        if user_question:
+            with st.chat_message("user"):
+                st.markdown(user_question)
+            
+            # Only send the plans the question is about to keep the prompt small
+            question_df = select_plans_for_question(comparison_df, user_question)
+            question_context = generate_context_for_llm(all_bids, question_df, summary)
+            st.session_state["last_context"] = (context, question_context)
+            
+            # Reuse a stored answer for a repeated question on the same data,
+            # otherwise stream it so it shows up token by token
+            answer_key = (question_context, user_question)
+            with st.chat_message("assistant"):
+                if answer_key in st.session_state["chat_answers"]:
+                    response = st.session_state["chat_answers"][answer_key]
+                    st.markdown(response)
+                else:
+                    response = st.write_stream(stream_chat_response(question_context, user_question))
+                    st.session_state["chat_answers"][answer_key] = response
             
             # Add to chat history
             st.session_state["chat_history"].append({
                 "question": user_question,
                 "answer": response
             })
-        
-        # Display chat history
-        st.markdown("---")
-        
-        if st.session_state["chat_history"]:
-            for i, chat in enumerate(reversed(st.session_state["chat_history"])):
-                # Question
-                st.markdown(f"**🧑 You:** {chat['question']}")
-                
-                # Answer
-                st.markdown(f"**🤖 AI:**")
-                st.markdown(chat['answer'])
-                
-                st.markdown("---")
-        else:
-            st.info("👆 Ask a question above to start chatting!")
-        
-        # Show context being used (collapsible)
+        elif not st.session_state["chat_history"]:
+            st.info("👇 Ask a question below to start chatting!")
+        
+        # Show the context last sent to the AI (the full context until a question is
+        # asked, or once the underlying data changes)
+        full_context, sent_context = st.session_state.get("last_context", (None, None))
+        if full_context != context:
+            sent_context = context
         with st.expander("🔍 View Context Data (what AI sees)"):
-            st.code(context, language="text")
+            st.code(sent_context, language="text")
 
 else:
     st.info("👈 Use the sidebar to extract data from bid files or load existing data")
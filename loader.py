@@ -1,7 +1,54 @@
 #pip install "unstructured[all-docs]"
+import os
+import pickle
+import hashlib
+import threading
+from functools import lru_cache
 from langchain_community.document_loaders import PyPDFLoader, UnstructuredExcelLoader
 
-def load_document(file_path):
+def load_document(file_path, cache_dir="./cache/docs"):
+    # Parsing is deterministic, so reuse it while the file's mtime and size are unchanged
+    stat = os.stat(file_path)
+    docs = _load_document_cached(os.path.abspath(file_path), stat.st_mtime, stat.st_size, cache_dir)
+    return list(docs)  # callers get their own list, not the shared cached one
+
+
+@lru_cache(maxsize=64)
+def _load_document_cached(file_path, mtime, size, cache_dir):
+    # <path hash>-<version hash>.pkl, so older versions of the same file can be found
+    path_key = hashlib.sha256(file_path.encode()).hexdigest()
+    version_key = hashlib.sha256(f"{mtime}|{size}".encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f"{path_key}-{version_key}.pkl")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            # Truncated, or pickled by an incompatible langchain version: re-parse
+            os.remove(cache_path)
+
+    docs = parse_document(file_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Drop pickles left over from earlier versions of this file
+    for name in os.listdir(cache_dir):
+        if name.startswith(f"{path_key}-") and name.endswith(".pkl"):
+            os.remove(os.path.join(cache_dir, name))
+
+    # Dump to a temp file and swap it in so a partial write is never loaded
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(docs, f)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return docs
+
+
+def parse_document(file_path):
     if file_path.endswith(".pdf"):
         loader = PyPDFLoader(file_path)
         return loader.load()   # page-wise docs
@@ -1,14 +1,45 @@
 import os
 import json
 import pandas as pd
+import tiktoken
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from loader import load_document
+from extraction_cache import file_cache_key, load_cached_plans, save_cached_plans
+from json_utils import dump_json
 from dotenv import load_dotenv
 
 load_dotenv()
 
-llm = ChatOpenAI(temperature=0, model="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY"))
+
+class Plan(BaseModel):
+    """One plan's pricing and location details"""
+    plan_number: str
+    total_price: Optional[float]
+    system_type: Optional[str]
+    tonnage: Optional[float]
+    rough_po: Optional[float]
+    trim_po: Optional[float]
+    city: Optional[str]
+    state: Optional[str]
+    zip: Optional[str]
+    metro_area: Optional[str]
+
+
+class Plans(BaseModel):
+    """All plans found in a chunk"""
+    plans: List[Plan]
+
+
+MODEL = "gpt-4o-mini"
+
+# Schema-enforced output: the API only returns valid Plans JSON
+llm = ChatOpenAI(
+    temperature=0, model=MODEL, api_key=os.getenv("OPENAI_API_KEY")
+).with_structured_output(Plans, method="json_schema")
 
 # Prompt to extract structured plan data
 extraction_prompt = PromptTemplate(
@@ -21,21 +52,15 @@ Extract ALL plan pricing information AND location details from this document.
 Document Content:
 {content}
 
-EXTRACT and return a JSON array with this EXACT format:
-[
-    {{
-        "plan_number": "4101",
-        "total_price": 9425.00,
-        "system_type": "Gas",
-        "tonnage": 3.5,
-        "rough_po": 5655.00,
-        "trim_po": 3770.00,
-        "city": "Fort Worth",
-        "state": "TX",
-        "zip": "76118",
-        "metro_area": "DFW"
-    }}
-]
+Return an object with a "plans" list containing one entry per plan. Each plan has:
+- plan_number: the plan number as text (e.g. "4101")
+- total_price: total price as a number (e.g. 9425.00)
+- system_type: system type (e.g. "Gas")
+- tonnage: tonnage as a number (e.g. 3.5)
+- rough_po: rough-in PO amount as a number (e.g. 5655.00)
+- trim_po: trim PO amount as a number (e.g. 3770.00)
+- city, state, zip: the address, if present (e.g. "Fort Worth", "TX", "76118")
+- metro_area: the metro area (e.g. "DFW")
 
 LOCATION RULES:
 - Extract city, state, and zip if address is present
@@ -46,103 +71,167 @@ LOCATION RULES:
 
 GENERAL RULES:
 1. Extract EVERY plan you find
-2. Use numeric values for prices (no $ symbol)
+2. Use plain numbers for prices (no $ symbol or commas)
 3. If a field is missing, use null
-4. Return ONLY the JSON array
-5. Do NOT add extra commentary
-6. Capture ALL plans even if there are 50+
-
-JSON Output:
+4. Capture ALL plans even if there are 50+
 """
 )
 
+# Cached plans are only valid for the model, prompt and schema that produced them
+CACHE_SALT = "|".join([MODEL, extraction_prompt.template, json.dumps(Plans.model_json_schema(), sort_keys=True)])
 
 
-def extract_plans_from_file(file_path):
-    """Extract all plan data from a single file"""
-    print(f"📄 Processing: {os.path.basename(file_path)}")
-    
-    # Load document
-    docs = load_document(file_path)
+
+# Tokenizer used by the extraction model
+encoding = tiktoken.encoding_for_model(MODEL)
+
+
+def count_tokens(text):
+    """Count model tokens in text"""
+    return len(encoding.encode(text))
+
+
+def split_long_line(line, max_tokens):
+    """Cut a line that alone exceeds max_tokens into token slices that fit"""
+    ids = encoding.encode(line)
+    if len(ids) + 1 <= max_tokens:
+        return [line]
     
-    # Combine all content (for smaller files) or process in chunks
-    all_content = "\n\n".join([doc.page_content for doc in docs])
+    step = max(1, max_tokens - 1)
+    return [encoding.decode(ids[i:i+step]) for i in range(0, len(ids), step)]
+
+
+def chunk_by_tokens(text, max_tokens=100_000, overlap=500):
+    """Split text on line boundaries into chunks of at most max_tokens tokens"""
+    chunks = []
+    lines, line_tokens = [], []
+    total = 0
     
-    # If content is too large, process in parts
-    max_chars = 50000  # Adjust based on model context window
+    pieces = (piece for line in text.split("\n") for piece in split_long_line(line, max_tokens))
+    for line in pieces:
+        tokens = count_tokens(line) + 1
+        if lines and total + tokens > max_tokens:
+            chunks.append("\n".join(lines))
+            
+            # Carry the last `overlap` tokens of lines into the next chunk
+            # so a table row cut at the boundary is still seen whole
+            # (never more than still fits next to the incoming line)
+            budget = min(overlap, max_tokens - tokens)
+            keep = 0
+            carried = 0
+            while keep < len(lines) and carried + line_tokens[-1 - keep] <= budget:
+                carried += line_tokens[-1 - keep]
+                keep += 1
+            lines = lines[len(lines) - keep:]
+            line_tokens = line_tokens[len(line_tokens) - keep:]
+            total = carried
+        
+        lines.append(line)
+        line_tokens.append(tokens)
+        total += tokens
     
-    all_plans = []
+    if text:
+        chunks.append("\n".join(lines))
     
-    if len(all_content) > max_chars:
-        # Process in chunks
-        chunks = [all_content[i:i+max_chars] for i in range(0, len(all_content), max_chars)]
-        for i, chunk in enumerate(chunks):
-            print(f"  Processing chunk {i+1}/{len(chunks)}...")
-            plans = extract_plans_from_content(chunk)
-            all_plans.extend(plans)
-    else:
-        all_plans = extract_plans_from_content(all_content)
+    return chunks
+
+
+def load_chunks(file_path, max_tokens=100_000):
+    """Load a file and split its text into LLM-sized chunks"""
+    # Load document
+    docs = load_document(file_path)
     
-    # Remove duplicates based on plan_number
+    # Combine all content, then split into parts if it is too large
+    # (max_tokens: gpt-4o-mini has a 128k context window)
+    all_content = "\n\n".join([doc.page_content for doc in docs])
+    return chunk_by_tokens(all_content, max_tokens)
+
+
+def dedupe_plans(all_plans):
+    """Remove duplicates based on plan_number (first occurrence wins)"""
+    # setdefault keeps the first plan per number, in first-seen order
     unique_plans = {}
     for plan in all_plans:
-        plan_num = plan.get("plan_number")
-        if plan_num and plan_num not in unique_plans:
-            unique_plans[plan_num] = plan
+        if plan.get("plan_number"):
+            unique_plans.setdefault(plan["plan_number"], plan)
     
-    print(f"  ✅ Extracted {len(unique_plans)} unique plans")
     return list(unique_plans.values())
 
 
-def extract_plans_from_content(content):
-    """Use LLM to extract plans from content"""
-    try:
-        prompt = extraction_prompt.format(content=content)
-        response = llm.invoke(prompt)
-        
-        # Parse JSON response
-        json_str = response.content.strip()
-        
-        # Clean up response if needed
-        if json_str.startswith("```json"):
-            json_str = json_str[7:]
-        if json_str.startswith("```"):
-            json_str = json_str[3:]
-        if json_str.endswith("```"):
-            json_str = json_str[:-3]
-        
-        plans = json.loads(json_str.strip())
-        return plans if isinstance(plans, list) else []
+def extract_plans_from_chunks(chunks, max_concurrency=20):
+    """Use LLM to extract plans from many chunks concurrently (one plan list per chunk, None if it failed)"""
+    prompts = [extraction_prompt.format(content=chunk) for chunk in chunks]
+    responses = llm.batch(
+        prompts,
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True
+    )
+    return [parse_plans(response) for response in responses]
+
+
+def parse_plans(response):
+    """Turn one structured LLM response (or the error it raised) into plan dicts"""
+    if isinstance(response, Exception):
+        print(f"  ⚠️ Extraction error: {response}")
+        return None
     
-    except json.JSONDecodeError as e:
-        print(f"  ⚠️ JSON parse error: {e}")
-        return []
-    except Exception as e:
-        print(f"  ⚠️ Extraction error: {e}")
-        return []
+    return [plan.model_dump() for plan in response.plans]
 
 
-def extract_all_bids(data_folder="./data"):
+def extract_all_bids(data_folder="./data", max_workers=8):
     """Extract plan data from all bid files"""
+    # Single directory scan; DirEntry answers is_file() without an extra stat
+    with os.scandir(data_folder) as entries:
+        paths = {
+            entry.name: entry.path
+            for entry in entries
+            if entry.is_file() and entry.name.endswith(('.pdf', '.xlsx', '.xls'))
+        }
+    
+    # Reuse cached extractions for files whose bytes haven't changed
     all_bids = {}
+    keys = {file: file_cache_key(file_path, CACHE_SALT) for file, file_path in paths.items()}
+    for file, key in keys.items():
+        cached = load_cached_plans(key)
+        if cached is not None:
+            print(f"  ♻️ {file}: {len(cached)} cached plans")
+            all_bids[file] = cached
     
-    for file in os.listdir(data_folder):
-        file_path = os.path.join(data_folder, file)
-        
-        if os.path.isdir(file_path):
-            continue
-        
-        if file.endswith(('.pdf', '.xlsx', '.xls')):
-            plans = extract_plans_from_file(file_path)
-            all_bids[file] = plans
+    pending = {file: file_path for file, file_path in paths.items() if file not in all_bids}
+    
+    # Load and split files in parallel (file I/O and parsing release the GIL)
+    print(f"📄 Loading {len(pending)} files...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        file_chunks = dict(zip(pending, executor.map(load_chunks, pending.values())))
+    
+    # Collect every (file, chunk) pair up front across all files
+    extracted = {file: [] for file in pending}
+    jobs = [(file, chunk) for file, chunks in file_chunks.items() for chunk in chunks]
+    
+    # Send all chunks to the LLM at once instead of one blocking call each
+    print(f"\n🤖 Extracting plans from {len(jobs)} chunks...")
+    results = extract_plans_from_chunks([chunk for _, chunk in jobs])
+    
+    failed = set()
+    for (file, _), plans in zip(jobs, results):
+        if plans is None:
+            failed.add(file)
+        else:
+            extracted[file].extend(plans)
+    
+    for file, plans in extracted.items():
+        all_bids[file] = dedupe_plans(plans)
+        if file not in failed:
+            save_cached_plans(keys[file], all_bids[file])
+        print(f"  ✅ {file}: {len(all_bids[file])} unique plans")
     
-    return all_bids
+    # Keep the folder's file order regardless of which files were cached
+    return {file: all_bids[file] for file in paths}
 
 
 def save_extracted_data(all_bids, output_path="./extracted_bads.json"):
     """Save extracted bid data to JSON"""
-    with open(output_path, "w") as f:
-        json.dump(all_bids, f, indent=2)
+    dump_json(all_bids, output_path, indent=2)
     print(f"\n💾 Saved extracted data to {output_path}")
 
 